@@ -1,17 +1,364 @@
 """Main module."""
+import bisect
+import gc
 import json
 import io
-import math
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Union, Tuple
+from typing import Dict, Iterable, Iterator, List, Union, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# struct format characters for the unsigned integer sizes struct supports natively
+_INT_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+# Version of the entry layout written to new databases. Databases without a version in their info use version 1
+_FORMAT_VERSION = 2
+
+# Entries of version 2 databases start with a fixed size part holding their key type and the length of their key in 2
+# bytes, unpacked together in one call while indexing
+_ENTRY_HEADER_STRUCT = struct.Struct("<BH")
+
+# Saved index files start with this magic followed by the size and mtime of the database file they were saved for, and
+# the amount of bytes taken up by deleted entries in it
+_INDEX_FILE_MAGIC = b"LDBI"
+_INDEX_FILE_HEADER = struct.Struct("<4sQqQ")
+
+# Least amount of integer keys added to or removed from a header index before they're merged into its sorted arrays
+_INDEX_MERGE_MIN = 1024
+
+# Saved header indexes start with if they were saved on a big endian machine, the amount of int keys, the amount of
+# string keys and the length of all string keys encoded together
+_HEADER_INDEX_HEADER = struct.Struct("<?QQQ")
+
+# Set on the key type byte of entries in version 2 databases that have been deleted
+_DELETED_FLAG = 0x80
+
+# Fraction of the database file deleted entries may take up before it's compacted
+_COMPACT_RATIO = 0.3
+
+# Amount of bytes appended entries may take up in memory before they're written to the file
+_WRITE_BUFFER_SIZE = 1 << 20
+
+# Types of values kept in the value cache. Mutable values aren't cached, changes made to one that's been read would show
+# up in later reads
+_CACHED_TYPES = (str, int, bytes)
+
+# Largest content length of values kept in the value cache, which bounds the memory it takes up to cache_size times this
+_CACHED_VALUE_MAX_LEN = 4096
 
 
 class IndexingError(Exception):
     pass
 
 
+if orjson is not None:
+    def _json_dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    _json_loads = orjson.loads
+else:
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode("utf-8")
+
+    def _json_loads(data):
+        # The json module only accepts bytes, bytearray and str, but content is handed over as a memoryview
+        return json.loads(bytes(data))
+
+
+@contextmanager
+def _no_gc():
+    """Keeps the garbage collector from running in between, since encoding and decoding dicts and lists creates a lot
+    of objects that may trigger a collection midway. Leaves the collector alone if it was already disabled. Only used
+    around dict and list codecs, for other values it costs more than it saves"""
+    if not gc.isenabled():
+        yield
+        return
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+
+class _WideInt:
+    """Mimics the parts of struct.Struct used by LazyDb for little endian unsigned integers of any size"""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def pack(self, value: int) -> bytes:
+        return value.to_bytes(self.size, 'little')
+
+    def unpack_from(self, buffer, offset: int = 0) -> Tuple[int]:
+        return (int.from_bytes(buffer[offset:offset + self.size], 'little'),)
+
+
+def _int_struct(size: int) -> Union[struct.Struct, _WideInt]:
+    """Gets a precompiled struct for a little endian unsigned integer of the given size"""
+    fmt = _INT_FORMATS.get(size)
+    if fmt is None:
+        return _WideInt(size)
+    return struct.Struct("<" + fmt)
+
+
+@lru_cache(maxsize=2048)
+def _encode_key(key: Union[str, int], key_int_size: int, version: int) -> bytes:
+    """Convert a key to the bytes leading its entry's header. Cached since the same keys tend to be written, deleted
+    and rewritten repeatedly"""
+    if isinstance(key, str):
+        key_type = 1
+        key_bytes = key.encode("utf-8")
+    else:
+        key_type = 2
+        # int_to_bytes is not used here since int keys are always key_int_size bytes long
+        try:
+            key_bytes = _int_struct(key_int_size).pack(key)
+        except struct.error:
+            # Raised as the same error int.to_bytes gives for key sizes struct doesn't support
+            raise OverflowError(f"Key {key} doesn't fit in {key_int_size} unsigned bytes") from None
+
+    if version == 1:
+        return b"\x00" + bytes((key_type,)) + key_bytes + b"\x00"
+    if len(key_bytes) > 0xFFFF:
+        raise ValueError(f"Key {key} is too long, keys may be at most 65535 bytes long")
+    return _ENTRY_HEADER_STRUCT.pack(key_type, len(key_bytes)) + key_bytes
+
+
+class HeaderIndex(MutableMapping):
+    """
+    Maps keys to the locations of their entries in the database
+
+    String keys are kept in a dict. Integer keys are kept sorted in an array next to an array of their locations, which
+    takes 16 bytes per key instead of a dict slot plus two int objects, and lets ranges of keys be found with bisect.
+    Integer keys added or removed are first kept aside in a dict and a set, and merged into the arrays all at once when
+    they're needed in order or have grown as large as the arrays, so changes don't each move the rest of the arrays.
+    """
+
+    def __init__(self, key_int_size: int = 4):
+        self.key_int_size = key_int_size
+        self.str_keys = {}
+        # Integer keys too big for an array fall back to being stored in a list
+        self.int_keys = array("Q") if key_int_size <= 8 else []
+        self.int_locations = array("Q")
+        # Integer keys not in the arrays yet, and keys still in the arrays that have been removed
+        self.added_ints = {}
+        self.removed_ints = set()
+
+    @classmethod
+    def from_dict(cls, headers: Dict[Union[str, int], int], key_int_size: int = 4) -> "HeaderIndex":
+        """Builds an index from a dict of keys to locations"""
+        index = cls(key_int_size)
+        int_headers = []
+        for key, location in headers.items():
+            if isinstance(key, int):
+                int_headers.append((key, location))
+            else:
+                index.str_keys[key] = location
+        # Sorts all integer keys at once rather than inserting them one at a time
+        int_headers.sort()
+        index.int_keys.extend(key for key, _ in int_headers)
+        index.int_locations.extend(location for _, location in int_headers)
+        return index
+
+    @classmethod
+    def load(cls, data: bytes, key_int_size: int = 4, offset: int = 0) -> "HeaderIndex":
+        """Builds an index from bytes made by dump, starting at offset. Raises ValueError if the bytes are malformed"""
+        big_endian, int_count, str_count, str_bytes_len = _HEADER_INDEX_HEADER.unpack_from(data, offset)
+        # Arrays are saved in the machine's own byte order
+        if big_endian != (sys.byteorder == "big"):
+            raise ValueError("Header index was saved on a machine with a different byte order")
+
+        index = cls(key_int_size)
+        pos = offset + _HEADER_INDEX_HEADER.size
+        str_lengths = array("I")
+        str_locations = array("Q")
+        with memoryview(data) as view:
+            if isinstance(index.int_keys, array):
+                index.int_keys.frombytes(view[pos:pos + int_count * 8])
+                pos += int_count * 8
+            else:
+                index.int_keys.extend(int.from_bytes(view[key_pos:key_pos + key_int_size], "little")
+                                      for key_pos in range(pos, pos + int_count * key_int_size, key_int_size))
+                pos += int_count * key_int_size
+            index.int_locations.frombytes(view[pos:pos + int_count * 8])
+            pos += int_count * 8
+            str_lengths.frombytes(view[pos:pos + str_count * 4])
+            pos += str_count * 4
+            str_locations.frombytes(view[pos:pos + str_count * 8])
+            pos += str_count * 8
+            str_text = str(view[pos:pos + str_bytes_len], "utf-8")
+            pos += str_bytes_len
+        if pos != len(data) or len(index.int_keys) != int_count or len(str_lengths) != str_count:
+            raise ValueError("Header index is malformed")
+
+        # String keys are decoded all at once, then split up by their lengths in characters
+        str_keys = []
+        start = 0
+        for length in str_lengths:
+            str_keys.append(str_text[start:start + length])
+            start += length
+        index.str_keys = dict(zip(str_keys, str_locations))
+        return index
+
+    def dump(self) -> bytes:
+        """Converts the index to bytes that can be loaded back with load"""
+        self.merge()
+        if isinstance(self.int_keys, array):
+            int_keys_bytes = self.int_keys.tobytes()
+        else:
+            int_keys_bytes = b"".join(key.to_bytes(self.key_int_size, "little") for key in self.int_keys)
+        str_bytes = "".join(self.str_keys).encode("utf-8")
+        return b"".join((_HEADER_INDEX_HEADER.pack(sys.byteorder == "big", len(self.int_keys), len(self.str_keys),
+                                                   len(str_bytes)),
+                         int_keys_bytes,
+                         self.int_locations.tobytes(),
+                         array("I", map(len, self.str_keys)).tobytes(),
+                         array("Q", self.str_keys.values()).tobytes(),
+                         str_bytes))
+
+    def find_int(self, key: int) -> int:
+        """Gets the position of an integer key in the int arrays, or -1 if it isn't in them. Keys that have been removed
+        but not merged out of the arrays yet are still found"""
+        position = bisect.bisect_left(self.int_keys, key)
+        if position < len(self.int_keys) and self.int_keys[position] == key:
+            return position
+        return -1
+
+    def get_int(self, key: int) -> Union[int, None]:
+        """Gets the location of an integer key, or None if it isn't in the index"""
+        location = self.added_ints.get(key)
+        if location is not None:
+            return location
+        if key in self.removed_ints:
+            return None
+        position = self.find_int(key)
+        return None if position == -1 else self.int_locations[position]
+
+    def merge(self):
+        """Merges integer keys added or removed since the last merge into the sorted int arrays"""
+        if not self.added_ints and not self.removed_ints:
+            return
+        removed_ints = self.removed_ints
+        if removed_ints:
+            merged = [(key, location) for key, location in zip(self.int_keys, self.int_locations)
+                      if key not in removed_ints]
+        else:
+            merged = list(zip(self.int_keys, self.int_locations))
+        # The arrays are already sorted, so sorting only has to merge the added keys into them
+        merged.extend(sorted(self.added_ints.items()))
+        merged.sort()
+
+        int_keys = array("Q") if isinstance(self.int_keys, array) else []
+        int_keys.extend([key for key, _ in merged])
+        self.int_keys = int_keys
+        self.int_locations = array("Q", [location for _, location in merged])
+        self.added_ints = {}
+        self.removed_ints = set()
+
+    def merge_if_grown(self):
+        """Merges pending integer key changes once there are enough of them that they're worth moving the arrays for"""
+        if len(self.added_ints) + len(self.removed_ints) > max(_INDEX_MERGE_MIN, len(self.int_keys)):
+            self.merge()
+
+    def int_range(self, start: int, stop: int) -> Iterable[int]:
+        """Gets all integer keys from start up to but not including stop, in order"""
+        self.merge()
+        return self.int_keys[bisect.bisect_left(self.int_keys, start):bisect.bisect_left(self.int_keys, stop)]
+
+    def shift(self, start: int, amount: int):
+        """Moves all locations at or past start back by amount"""
+        self.merge()
+        # Only values are replaced, so str_keys can be updated in place while iterating over it
+        str_keys = self.str_keys
+        for key, location in str_keys.items():
+            if location >= start:
+                str_keys[key] = location - amount
+        # Building a list first lets array size itself once instead of growing as a generator is consumed
+        self.int_locations = array("Q", [location - amount if location >= start else location
+                                         for location in self.int_locations])
+
+    def get(self, key: Union[str, int], default: Union[int, None] = None) -> Union[int, None]:
+        # Overridden so lookups go straight to the dict or arrays, rather than through Mapping.get catching a KeyError
+        if isinstance(key, int):
+            location = self.get_int(key)
+            return default if location is None else location
+        return self.str_keys.get(key, default)
+
+    def __contains__(self, key: Union[str, int]) -> bool:
+        if isinstance(key, int):
+            return self.get_int(key) is not None
+        return key in self.str_keys
+
+    def __getitem__(self, key: Union[str, int]) -> int:
+        if isinstance(key, int):
+            location = self.get_int(key)
+            if location is None:
+                raise KeyError(key)
+            return location
+        return self.str_keys[key]
+
+    def __setitem__(self, key: Union[str, int], location: int):
+        if not isinstance(key, int):
+            self.str_keys[key] = location
+            return
+        # Runs once per entry written, so the lookups done by find_int and merge_if_grown are inlined
+        added_ints = self.added_ints
+        if key in added_ints:
+            added_ints[key] = location
+            return
+        int_keys = self.int_keys
+        position = bisect.bisect_left(int_keys, key)
+        if position < len(int_keys) and int_keys[position] == key:
+            # Keys still in the arrays are updated in place, even if they've been removed since the last merge
+            self.removed_ints.discard(key)
+            self.int_locations[position] = location
+            return
+        added_ints[key] = location
+        if len(added_ints) > _INDEX_MERGE_MIN:
+            self.merge_if_grown()
+
+    def __delitem__(self, key: Union[str, int]):
+        if not isinstance(key, int):
+            del self.str_keys[key]
+            return
+        if key in self.added_ints:
+            del self.added_ints[key]
+            return
+        if key in self.removed_ints or self.find_int(key) == -1:
+            raise KeyError(key)
+        self.removed_ints.add(key)
+        self.merge_if_grown()
+
+    def __iter__(self) -> Iterator[Union[str, int]]:
+        self.merge()
+        yield from self.str_keys
+        yield from self.int_keys
+
+    def __len__(self) -> int:
+        return len(self.str_keys) + len(self.int_keys) + len(self.added_ints) - len(self.removed_ints)
+
+
 class LazyDb:
-    def __init__(self, file: str, key_int_size: int = 4, content_int_size: int = 4, int_list_size: int = 4):
+    def __init__(self, file: str, key_int_size: int = 4, content_int_size: int = 4, int_list_size: int = 4,
+                 cache_size: int = 256, dict_format: str = None):
         """
         Opens database and sets specified db settings if bootstrapping a new database
 
@@ -19,64 +366,230 @@ class LazyDb:
         :param key_int_size: The amount of bytes long a key should be when it's an integer
         :param content_int_size: The amount of bytes used to describe content length
         :param int_list_size: The amount of bytes used to define each entry in a list
+        :param cache_size: The amount of recently read small values to keep decoded in memory. 0 disables caching
+        :param dict_format: How dicts and lists that aren't int lists are stored, either "msgpack" or "json". Defaults to
+        msgpack when it's installed
         """
+        # Codecs are taken from the class and called with the database passed in, methods bound to the database would
+        # keep it from being freed as soon as it's dropped by making a reference cycle
+        cls = type(self)
+        # Content decoders indexed by content type byte
+        self.decoders = (None, cls.bytes_to_str, cls.bytes_to_int, cls.bytes_to_dict, cls.bytes_to_int_list,
+                         cls.copy_bytes, cls.bytes_to_msgpack_dict, cls.bytes_to_signed_int)
+        # Content encoders by exact type, bool is included since it's only an int subclass
+        self.encoders = {str: cls.str_to_bytes,
+                         int: cls.int_to_bytes,
+                         bool: cls.int_to_bytes,
+                         list: cls.list_to_bytes,
+                         dict: cls.dict_to_bytes,
+                         bytes: cls.bytes_to_bytes}
+
+        # Recently read values by key, least recently used first
+        self.cache_size = cache_size
+        self.value_cache = OrderedDict()
+
         path = Path(file)
+        self.path = path
+        self.index_file = path.with_name(path.name + ".idx")
+        self.dead_bytes = 0
         if not path.is_file():
+            if dict_format is None:
+                dict_format = "msgpack" if msgpack is not None else "json"
+            if dict_format not in ("msgpack", "json"):
+                raise ValueError(f"{dict_format} is not a supported dict format, use either msgpack or json")
             path.touch()
+            # An index left over from a previously deleted database under the same name must not be used
+            self.index_file.unlink(missing_ok=True)
             self.key_int_size = key_int_size
             self.content_int_size = content_int_size
             self.int_list_size = int_list_size
+            self.version = _FORMAT_VERSION
+            self.dict_format = dict_format
+            self.setup_structs()
             self.f = open(file, "rb+")
             self.write_info()
-            self.headers = {}
+            self.f.flush()
+            self.map_file()
+            self.file_end = self.capacity = len(self.mm)
+            self.write_buffer = bytearray()
+            self.headers = HeaderIndex(self.key_int_size)
             return
 
         self.f = open(file, "rb+")
+        self.map_file()
+        # The file may have zeroed space preallocated past its last entry if it wasn't closed cleanly, in which case
+        # file_end is corrected by get_headers
+        self.file_end = self.capacity = len(self.mm)
+        self.write_buffer = bytearray()
         info = self.get_info()
         self.key_int_size = info["key_int_size"]
         self.content_int_size = info["content_int_size"]
         self.int_list_size = info["int_list_size"]
-        self.headers = self.get_headers()
+        self.version = info.get("version", 1)
+        if self.version > _FORMAT_VERSION:
+            raise IndexingError(f"Database format version {self.version} is newer than this version of lazy_db "
+                                f"supports ({_FORMAT_VERSION}).")
+        self.dict_format = info.get("dict_format", "json")
+        self.setup_structs()
+        self.headers = self.load_index()
+        if self.headers is None:
+            # Indexing reads through the whole file in order, unlike reading values
+            self.advise("MADV_SEQUENTIAL")
+            self.headers = HeaderIndex.from_dict(self.get_headers(), self.key_int_size)
+            self.advise("MADV_RANDOM")
+
+    def map_file(self):
+        """Maps the database file into memory"""
+        self.mm = mmap.mmap(self.f.fileno(), 0)
+        # Values are read from scattered locations, so reading ahead of them only pulls in pages that won't be used
+        self.advise("MADV_RANDOM")
+
+    def advise(self, option: str):
+        """Hints to the kernel how the mapped database file will be accessed, on platforms that support it"""
+        if hasattr(mmap, option):
+            self.mm.madvise(getattr(mmap, option))
+
+    def setup_structs(self):
+        """Precompiles the structs used for fixed size integers and picks the dict encoder. Should be called once db
+        settings are known"""
+        self.key_struct = _int_struct(self.key_int_size)
+        self.content_struct = _int_struct(self.content_int_size)
+        # Dicts are always stored the way the database was set up to, so they read back the same wherever it's opened
+        if self.dict_format == "msgpack":
+            self.encoders[dict] = type(self).msgpack_dict_to_bytes
 
     def get_headers(self) -> Dict[Union[str, int], int]:
-        """Gets all headers from entries in database"""
+        """Gets all headers from entries in database, and sets file_end to where the last entry ends and dead_bytes to
+        the amount of bytes taken up by deleted entries"""
+        if self.version == 1:
+            return self.get_legacy_headers()
+
+        self.dead_bytes = 0
         headers_out = {}
+        # Everything used per entry is bound to a local up front, this loop runs once for every entry in the database
+        mm = self.mm
+        end = len(mm)
+        content_int_size = self.content_int_size
+        unpack_key = self.key_struct.unpack_from
+        unpack_entry_header = _ENTRY_HEADER_STRUCT.unpack_from
+        entry_header_size = _ENTRY_HEADER_STRUCT.size
+        unpack_len = self.content_struct.unpack_from
 
-        self.f.seek(0, io.SEEK_SET)
-        self.seek_to(b"\x00")
+        pos = mm.find(b"\x00") + 1
+        if pos == 0:
+            return headers_out
 
-        while True:
-            if not self.f.read(1) == b"\x00":
+        # Zeroed space preallocated past the last entry may be too short to hold a whole entry header
+        while pos + entry_header_size <= end:
+            key_type, key_len = unpack_entry_header(mm, pos)
+            if key_type == 0:
+                # Reached the zeroed space preallocated past the last entry
                 break
-            key_type = self.f.read(1)
-            if key_type == b"\x01":
-                key_bytes = self.read_to(b"\x00")
-                key = self.bytes_to_str(key_bytes)
-            elif key_type == b"\x02":
-                key_bytes = self.f.read(self.key_int_size)
-                self.f.seek(1, io.SEEK_CUR)
-                key = self.bytes_to_int(key_bytes)
+            key_start = pos + entry_header_size
+            key_end = key_start + key_len
+            if key_type & _DELETED_FLAG:
+                entry_end = key_end + content_int_size + unpack_len(mm, key_end)[0]
+                self.dead_bytes += entry_end - pos
+                pos = entry_end
+                continue
+            if key_type == 1:
+                key = mm[key_start:key_end].decode("utf-8")
+            elif key_type == 2:
+                key = unpack_key(mm, key_start)[0]
             else:
-                raise IndexingError(f"Encountered a problem while indexing: key header byte {key_type} is not a"
-                                    f"supported header byte. Your database may be corrupted.")
-            headers_out[key] = self.f.tell()
+                raise IndexingError(f"Encountered a problem while indexing: key header byte {bytes([key_type])} is "
+                                    f"not a supported header byte. Your database may be corrupted.")
+            headers_out[key] = key_end
+            pos = key_end + content_int_size + unpack_len(mm, key_end)[0]
+
+        self.file_end = pos
+        return headers_out
 
-            length_bytes = self.f.read(self.content_int_size)
-            length = self.bytes_to_int(length_bytes)
-            self.f.seek(length, io.SEEK_CUR)
+    def get_legacy_headers(self) -> Dict[Union[str, int], int]:
+        """Gets all headers from entries in a version 1 database, where keys are terminated by a NUL byte, and sets
+        file_end to where the last entry ends"""
+        headers_out = {}
+        # Everything used per entry is bound to a local up front, this loop runs once for every entry in the database
+        mm = self.mm
+        find = mm.find
+        end = len(mm)
+        key_int_size = self.key_int_size
+        content_int_size = self.content_int_size
+        unpack_key = self.key_struct.unpack_from
+        unpack_len = self.content_struct.unpack_from
+
+        pos = find(b"\x00") + 1
+        if pos == 0:
+            return headers_out
+
+        # Zeroed space preallocated past the last entry may be a single byte, too short to hold a key type
+        while pos + 1 < end:
+            # Entries start with a NUL byte, and the zeroed space preallocated past the last entry has no key type
+            if mm[pos] != 0 or mm[pos + 1] == 0:
+                break
+            key_type = mm[pos + 1]
+            key_start = pos + 2
+            if key_type == 1:
+                key_end = find(b"\x00", key_start)
+                key = mm[key_start:key_end].decode("utf-8")
+            elif key_type == 2:
+                key_end = key_start + key_int_size
+                key = unpack_key(mm, key_start)[0]
+            else:
+                raise IndexingError(f"Encountered a problem while indexing: key header byte {bytes([key_type])} is "
+                                    f"not a supported header byte. Your database may be corrupted.")
+            location = key_end + 1
+            headers_out[key] = location
+            pos = location + content_int_size + unpack_len(mm, location)[0]
 
+        self.file_end = pos
         return headers_out
 
+    def locate(self, location: int) -> Tuple[Union[mmap.mmap, bytearray], int]:
+        """Gets the buffer holding a location in the database, either the file or the write buffer, and the offset of
+        the location within it"""
+        if location >= self.file_end:
+            return self.write_buffer, location - self.file_end
+        return self.mm, location
+
+    def load_index(self) -> Union[HeaderIndex, None]:
+        """Loads the headers saved when the database was last closed, if the database file hasn't changed since"""
+        try:
+            data = self.index_file.read_bytes()
+            magic, size, mtime, dead_bytes = _INDEX_FILE_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+
+        stat = os.fstat(self.f.fileno())
+        if magic != _INDEX_FILE_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns:
+            return None
+        try:
+            headers = HeaderIndex.load(data, self.key_int_size, _INDEX_FILE_HEADER.size)
+        except (ValueError, struct.error):
+            return None
+        self.dead_bytes = dead_bytes
+        return headers
+
+    def save_index(self):
+        """Saves the headers next to the database file so they don't have to be rebuilt when it's next opened"""
+        stat = os.fstat(self.f.fileno())
+        index_header = _INDEX_FILE_HEADER.pack(_INDEX_FILE_MAGIC, stat.st_size, stat.st_mtime_ns, self.dead_bytes)
+        try:
+            self.index_file.write_bytes(index_header + self.headers.dump())
+        except OSError:
+            # The index only saves time when opening, without it the headers are rebuilt from the file. A partially
+            # written index fails to load and is ignored
+            pass
+
     def read_len(self, key: Union[str, int]) -> Union[int, None]:
-        """Reads the content length of a given key and leaves the file pointer at the end of the length bytes"""
+        """Reads the content length of a given key"""
         location = self.headers.get(key, None)
 
         if location is None:
             raise KeyError("No entry found for that key")
 
-        self.f.seek(location, io.SEEK_SET)
-        length_bytes = self.f.read(self.content_int_size)
-        return self.bytes_to_int(length_bytes)
+        buffer, offset = self.locate(location)
+        return self.content_struct.unpack_from(buffer, offset)[0]
 
     def read(self, key: Union[str, int]) -> Union[str, int, List[Union[str, int, dict]], Dict[Union[str, int], Union[str, int, list, dict]], None]:
         """
@@ -85,48 +598,77 @@ class LazyDb:
         :param key: The key of the entry you are reading
         :return: Content under key specified
         """
-        length = self.read_len(key)
+        if key in self.value_cache:
+            self.value_cache.move_to_end(key)
+            return self.value_cache[key]
+
+        location = self.headers.get(key, None)
 
-        content_bytes = self.f.read(length)
-        content = self.from_bytes(content_bytes)
+        if location is None:
+            raise KeyError("No entry found for that key")
 
+        # The location is looked up and resolved to a buffer once here rather than again through read_len
+        buffer, offset = self.locate(location)
+        length = self.content_struct.unpack_from(buffer, offset)[0]
+        content_start = offset + self.content_int_size
+        content = self.decode(buffer, content_start, content_start + length)
+
+        if length <= _CACHED_VALUE_MAX_LEN and type(content) in _CACHED_TYPES:
+            self.cache_value(key, content)
         return content
 
+    def cache_value(self, key: Union[str, int], value: Union[str, int, bytes]):
+        """Keeps a value in the value cache, evicting the least recently used value once the cache is full"""
+        if self.cache_size <= 0:
+            return
+        self.value_cache[key] = value
+        self.value_cache.move_to_end(key)
+        if len(self.value_cache) > self.cache_size:
+            self.value_cache.popitem(last=False)
+
+    def read_view(self, key: Union[str, int]) -> memoryview:
+        """
+        Gets a bytes value from the database as a view into the database file, without copying it out. The view must be
+        released (or used in a with block) before the database is flushed, committed or closed, since the file can't be
+        resized or unmapped while it's held
+
+        :param key: The key of the bytes entry you are reading
+        :return: View of the content under key specified
+        """
+        location = self.headers.get(key, None)
+
+        if location is None:
+            raise KeyError("No entry found for that key")
+
+        if location >= self.file_end:
+            # A view into the write buffer would keep any more entries from being appended to it
+            self.flush()
+        length = self.content_struct.unpack_from(self.mm, location)[0]
+        content_start = location + self.content_int_size
+        if self.mm[content_start] != 5:
+            raise TypeError(f"Entry under key {key} is not a bytes object")
+        with memoryview(self.mm) as view:
+            return view[content_start + 1:content_start + length]
+
     def get_info(self) -> dict:
         """Gets db info"""
-        self.f.seek(0, io.SEEK_SET)
-        data_bytes = self.read_to(b"\x00")
+        data_bytes = self.mm[:self.mm.find(b"\x00")]
         info_dict = self.bytes_to_dict(data_bytes)
         return info_dict
 
-    def read_to(self, to_byte: bytes) -> bytes:
-        """Reads to specified byte"""
-        out_array = bytearray()
-        while byte := self.f.read(1):
-            if byte == to_byte:
-                break
-            out_array += byte
-        return bytes(out_array)
-
-    def seek_to(self, to_byte: bytes) -> bool:
-        """Seeks to specified byte"""
-        while byte := self.f.read(1):
-            if byte == to_byte:
-                return True
-            if byte == b"":
-                return False
-
     def write_info(self):
         """Writes db info. Only should be called when a new database is bootstrapped"""
         info = {"key_int_size": self.key_int_size,
                 "content_int_size": self.content_int_size,
-                "int_list_size": self.int_list_size}
+                "int_list_size": self.int_list_size,
+                "version": self.version,
+                "dict_format": self.dict_format}
         info_str = self.dict_to_bytes(info, add_type_header=False)
         self.f.write(info_str + b"\x00")
 
     def bytes_to_str(self, bytes_in: bytes) -> str:
         """Convert bytes to string"""
-        return bytes_in.decode("utf-8")
+        return str(bytes_in, "utf-8")
 
     def str_to_bytes(self, string_in: str, add_type_header: bool = True) -> bytes:
         """Convert a string to bytes"""
@@ -139,11 +681,28 @@ class LazyDb:
         """Convert bytes to int"""
         return int.from_bytes(bytes_in, 'little')
 
+    def bytes_to_signed_int(self, bytes_in: bytes) -> int:
+        """Convert bytes to a negative int"""
+        return int.from_bytes(bytes_in, 'little', signed=True)
+
+    def signed_int_to_bytes(self, integer_in: int, add_type_header: bool = True) -> bytes:
+        """Convert a negative integer to bytes"""
+        # Calculates the least amount of bytes the integer and its sign bit can be fit into. In two's complement the bits
+        # below the sign bit of a negative integer hold ~integer_in (-integer_in - 1), so -128 still fits in 1 byte
+        length = ((~integer_in).bit_length() + 8) // 8
+
+        data = integer_in.to_bytes(length, 'little', signed=True)
+        if add_type_header:
+            return b"\x07" + data
+        return data
+
     def int_to_bytes(self, integer_in: int, add_type_header: bool = True, length: int = None) -> bytes:
         """Convert an integer to bytes"""
         if length is None:
-            # Calculates the least amount of bytes the integer can be fit into
-            length = math.ceil(math.log(integer_in)/math.log(256))
+            if integer_in < 0:
+                return self.signed_int_to_bytes(integer_in, add_type_header=add_type_header)
+            # Calculates the least amount of bytes the integer can be fit into, which is at least 1 to be able to store 0
+            length = max(1, (integer_in.bit_length() + 7) // 8)
 
         data = integer_in.to_bytes(length, 'little')
         if add_type_header:
@@ -152,19 +711,41 @@ class LazyDb:
 
     def bytes_to_dict(self, bytes_in: bytes) -> dict:
         """Convert bytes to dict"""
-        str_value = self.bytes_to_str(bytes_in)
-        return json.loads(str_value)
+        with _no_gc():
+            return _json_loads(bytes_in)
 
     def dict_to_bytes(self, dict_in: dict, add_type_header: bool = True) -> bytes:
         """Convert dictionary to bytes"""
-        json_str = json.dumps(dict_in, separators=(',', ':'))
-        data = self.str_to_bytes(json_str, add_type_header=False)
+        with _no_gc():
+            data = _json_dumps(dict_in)
         if add_type_header:
             return b"\x03" + data
         return data
 
+    def bytes_to_msgpack_dict(self, bytes_in: bytes) -> Union[dict, list]:
+        """Convert msgpack bytes to dict (or list)"""
+        if msgpack is None:
+            raise ImportError("msgpack must be installed to read dictionaries that were written with it")
+        with _no_gc():
+            return msgpack.unpackb(bytes_in, raw=False, strict_map_key=False)
+
+    def msgpack_dict_to_bytes(self, dict_in: Union[dict, list], add_type_header: bool = True) -> bytes:
+        """Convert dictionary (or list) to msgpack bytes"""
+        if msgpack is None:
+            raise ImportError("msgpack must be installed to write dictionaries to a database that stores them with it")
+        with _no_gc():
+            data = msgpack.packb(dict_in, use_bin_type=True)
+        if add_type_header:
+            return b"\x06" + data
+        return data
+
     def bytes_to_int_list(self, bytes_in: bytes) -> list:
         """Convert bytes to int list"""
+        fmt = _INT_FORMATS.get(self.int_list_size)
+        if fmt is not None:
+            with _no_gc():
+                return list(struct.unpack_from(f"<{len(bytes_in) // self.int_list_size}{fmt}", bytes_in))
+
         list_out = []
         byte_groups = len(bytes_in) // self.int_list_size
         for i in range(byte_groups):
@@ -176,77 +757,173 @@ class LazyDb:
 
     def int_list_to_bytes(self, list_in: List[int], add_type_header: bool = True) -> bytes:
         """Convert int list to bytes"""
-        out_array = bytearray()
-        for value in list_in:
-            value_bytes = self.int_to_bytes(value, add_type_header=False, length=self.int_list_size)
-            out_array.extend(value_bytes)
+        fmt = _INT_FORMATS.get(self.int_list_size)
+        if fmt is not None:
+            try:
+                with _no_gc():
+                    data = struct.pack(f"<{len(list_in)}{fmt}", *list_in)
+            except struct.error:
+                raise OverflowError(f"List has ints that don't fit in {self.int_list_size} unsigned bytes") from None
+        else:
+            out_array = bytearray()
+            for value in list_in:
+                value_bytes = self.int_to_bytes(value, add_type_header=False, length=self.int_list_size)
+                out_array.extend(value_bytes)
+            data = bytes(out_array)
+
+        if add_type_header:
+            return b"\x04" + data
+        return data
+
+    def copy_bytes(self, bytes_in: bytes) -> bytes:
+        """Copy bytes content out to a bytes object"""
+        return bytes(bytes_in)
 
+    def bytes_to_bytes(self, bytes_in: bytes, add_type_header: bool = True) -> bytes:
+        """Convert a bytes object to bytes content"""
         if add_type_header:
-            out_array.insert(0, 4)
-            return bytes(out_array)
-        return bytes(out_array)
+            return b"\x05" + bytes_in
+        return bytes_in
+
+    def list_to_bytes(self, list_in: list, add_type_header: bool = True) -> bytes:
+        """Convert list to bytes. Lists of ints that fit in int_list_size are stored as int lists, any other list is
+        stored the same way as a dict"""
+        if all(isinstance(value, int) for value in list_in):
+            try:
+                return self.int_list_to_bytes(list_in, add_type_header=add_type_header)
+            except OverflowError:
+                # Negative ints and ints too big for int_list_size are left to be stored like any other list
+                pass
+        if self.dict_format == "msgpack":
+            return self.msgpack_dict_to_bytes(list_in, add_type_header=add_type_header)
+        return self.dict_to_bytes(list_in, add_type_header=add_type_header)
 
     def from_bytes(self, bytes_data: bytes) -> Union[str, int, List[Union[str, int, dict]], Dict[Union[str, int], Union[str, int, list, dict]]]:
         """Converts a given bytes value to object form"""
-        bytes_type = bytes_data[0]
-        bytes_data = bytes_data[1:]
-        if bytes_type == 1:
-            return self.bytes_to_str(bytes_data)
-        if bytes_type == 2:
-            return self.bytes_to_int(bytes_data)
-        if bytes_type == 3:
-            return self.bytes_to_dict(bytes_data)
-        if bytes_type == 4:
-            return self.bytes_to_int_list(bytes_data)
-        if bytes_type == 5:
-            return bytes_data
-        raise TypeError(f"Incorrect type header byte: {bytes_type}. Your database may be corrupted.")
+        return self.decode(bytes_data, 0, len(bytes_data))
+
+    def decode(self, buffer: Union[bytes, bytearray, mmap.mmap], start: int, end: int) -> Union[str, int, List[Union[str, int, dict]], Dict[Union[str, int], Union[str, int, list, dict]]]:
+        """Converts the value stored between two offsets of a buffer to object form without copying it out first"""
+        bytes_type = buffer[start]
+        decoder = self.decoders[bytes_type] if bytes_type < len(self.decoders) else None
+        if decoder is None:
+            raise TypeError(f"Incorrect type header byte: {bytes_type}. Your database may be corrupted.")
+        # Views must be released before returning, the buffer can't be resized or unmapped while any are held
+        with memoryview(buffer) as view, view[start + 1:end] as content:
+            return decoder(self, content)
 
     def to_bytes(self, value: Union[str, bytes, int, List[Union[str, int, dict]], Dict[Union[str, int], Union[str, int, list, dict]]], add_type_header: bool = True) -> bytes:
         """Converts a given object to byte form"""
-        if isinstance(value, str):
-            return self.str_to_bytes(value, add_type_header=add_type_header)
-        if isinstance(value, int):
-            return self.int_to_bytes(value, add_type_header=add_type_header)
-        if isinstance(value, list):
-            return self.int_list_to_bytes(value, add_type_header=add_type_header)
-        if isinstance(value, dict):
-            return self.dict_to_bytes(value, add_type_header=add_type_header)
-        if isinstance(value, bytes):
-            if add_type_header:
-                return b"\x05" + value
-            return value
-        raise TypeError(f"{type(value)} is not a supported content type to be written to the database.")
-
-    def gen_header(self, key: Union[str, int], data: bytes) -> Tuple[bytes, int]:
-        """Generate header and get content offset"""
+        encoder = self.encoders.get(type(value))
+        if encoder is None:
+            # Falls back to checking for subclasses of the supported types
+            for value_type, type_encoder in self.encoders.items():
+                if isinstance(value, value_type):
+                    encoder = type_encoder
+                    break
+            else:
+                raise TypeError(f"{type(value)} is not a supported content type to be written to the database.")
+        return encoder(self, value, add_type_header=add_type_header)
+
+    def encode_key(self, key: Union[str, int]) -> bytes:
+        """Convert a key to the bytes leading its entry's header, which hold the key and its type"""
+        if not isinstance(key, (str, int)):
+            raise TypeError(f"{type(key)} is not a supported key type to be written to the database.")
+        return _encode_key(key, self.key_int_size, self.version)
+
+    def gen_header(self, key: Union[str, int], data: bytes, key_bytes: bytes = None) -> Tuple[bytes, int]:
+        """Generate header and get content offset. key_bytes may be given if the key has already been encoded"""
         content_len = len(data)
         # int_to_bytes is not used here since we want to define the int size separately from content, as well as we
         # don't need the type identifier byte
-        content_len_bytes = self.int_to_bytes(content_len, add_type_header=False, length=self.content_int_size)
-        if isinstance(key, str):
-            key_bytes = self.str_to_bytes(key)
-        elif isinstance(key, int):
-            key_bytes = self.int_to_bytes(key, length=self.key_int_size)
-        else:
-            raise TypeError(f"{type(key)} is not a supported key type to be written to the database.")
+        try:
+            content_len_bytes = self.content_struct.pack(content_len)
+        except struct.error:
+            raise OverflowError(f"Content is {content_len} bytes long, which doesn't fit in {self.content_int_size} "
+                                f"unsigned bytes") from None
+        if key_bytes is None:
+            key_bytes = self.encode_key(key)
 
-        content_offset = len(key_bytes) + 2
-        return b"\x00" + key_bytes + b"\x00" + content_len_bytes, content_offset
+        return key_bytes + content_len_bytes, len(key_bytes)
 
-    def write_raw_bytes(self, data: bytes) -> int:
-        """Writes raw bytes to database and returns the location it was written to"""
-        self.f.seek(0, io.SEEK_END)
-        location = self.f.tell()
-        self.f.write(data)
+    def write_raw_bytes(self, *chunks: bytes) -> int:
+        """Appends chunks of raw bytes one after another to the write buffer, flushing it once full, and returns the
+        location they were written to. Passing chunks separately saves joining them together first"""
+        buffered = len(self.write_buffer)
+        location = self.file_end + buffered
+        for chunk in chunks:
+            self.write_buffer += chunk
+        if len(self.write_buffer) >= _WRITE_BUFFER_SIZE:
+            try:
+                self.flush()
+            except BaseException:
+                # The chunks are taken back out so they don't reach the file on a later flush without being indexed
+                del self.write_buffer[buffered:]
+                raise
         return location
 
-    def write_bytes(self, key: Union[str, int], data: bytes) -> int:
-        """Writes bytes to database under key and returns location here content starts"""
-        if key in self.headers:
-            raise KeyError(f"Key {key} is already in the database")
-        header, content_offset = self.gen_header(key, data)
-        write_location = self.write_raw_bytes(header + data)
+    def flush(self):
+        """Writes all buffered entries to the database file"""
+        if not self.write_buffer:
+            return
+        self.reserve(self.file_end + len(self.write_buffer))
+        self.write_at(self.write_buffer, self.file_end)
+        self.file_end += len(self.write_buffer)
+        self.write_buffer.clear()
+
+    def reserve(self, size: int):
+        """Makes sure the database file is at least size bytes long. The file is grown by at least double its size at a
+        time, so the file and the mmap only need to be resized a logarithmic amount of times as the database grows"""
+        if size <= self.capacity:
+            return
+        capacity = max(size, self.capacity * 2)
+        self.remap(capacity)
+        self.capacity = capacity
+
+    def trim(self):
+        """Cuts off any space preallocated past the last entry in the database file"""
+        if self.capacity != self.file_end:
+            self.remap(self.file_end)
+            self.capacity = self.file_end
+
+    def remap(self, size: int):
+        """Resizes the database file and maps it into memory again. mmap.resize isn't used, it's only available on
+        platforms with mremap"""
+        # Closing the mmap fails while a view from read_view is held, before the file has been changed
+        self.mm.close()
+        try:
+            os.ftruncate(self.f.fileno(), size)
+        finally:
+            self.map_file()
+
+    def commit(self):
+        """Writes all buffered entries to the database file and waits for all changes to it to reach the disk"""
+        self.flush()
+        self.mm.flush()
+        os.fsync(self.f.fileno())
+
+    def write_at(self, data: bytes, location: int):
+        """Writes raw bytes to the database file at the specified location"""
+        if not hasattr(os, "pwrite"):
+            self.f.seek(location, io.SEEK_SET)
+            self.f.write(data)
+            self.f.flush()
+            return
+        # Positioned writes don't need a seek beforehand, and may write less than asked for. The rest of the data is
+        # sliced out of a view so it isn't copied on every short write. Every view is released even if a write fails,
+        # so the data can still be resized afterwards
+        written = 0
+        with memoryview(data) as view:
+            while written < len(view):
+                with view[written:] as rest:
+                    written += os.pwrite(self.f.fileno(), rest, location + written)
+
+    def write_bytes(self, key: Union[str, int], data: bytes, key_bytes: bytes = None) -> int:
+        """Writes bytes to database under key and returns location here content starts. key_bytes may be given if the
+        key has already been encoded. The key isn't checked for being in the database already, write does that before
+        encoding the value"""
+        header, content_offset = self.gen_header(key, data, key_bytes)
+        write_location = self.write_raw_bytes(header, data)
         return write_location + content_offset
 
     def write(self, key: Union[str, int], value: Union[str, bytes, int, List[Union[str, int, dict]], Dict[Union[str, int], Union[str, int, list, dict]]]):
@@ -256,53 +933,144 @@ class LazyDb:
         :param key: key to store value under. Key must not be already used
         :param value: content to store under specified key
         """
+        # The key is checked and encoded before the value so a bad key fails before any work is done on the value
+        if key in self.headers:
+            raise KeyError(f"Key {key} is already in the database")
+        key_bytes = self.encode_key(key)
         data = self.to_bytes(value)
-        content_location = self.write_bytes(key, data)
+        content_location = self.write_bytes(key, data, key_bytes)
         self.headers[key] = content_location
 
+    def write_many(self, items: Iterable[Tuple[Union[str, int], Union[str, bytes, int, List[Union[str, int, dict]], Dict[Union[str, int], Union[str, int, list, dict]]]]]):
+        """
+        Writes many values to the database, then commits them to disk all at once
+
+        :param items: (key, value) pairs to write. Keys must not be already used
+        """
+        for key, value in items:
+            self.write(key, value)
+        self.commit()
+
+    def read_range(self, start: int, stop: int) -> Dict[int, Union[str, int, List[Union[str, int, dict]], Dict[Union[str, int], Union[str, int, list, dict]]]]:
+        """
+        Gets the values of all integer keys within a range from the database, in key order
+
+        :param start: The lowest key to include
+        :param stop: The key to stop at. Not included
+        :return: Dict of the keys in range and their content
+        """
+        return {key: self.read(key) for key in self.headers.int_range(start, stop)}
+
     def reconstruct_header_size(self, key: Union[str, int]):
-        if isinstance(key, str):
-            key_size = len(self.str_to_bytes(key, add_type_header=False))
-        else:
-            key_size = self.key_int_size
-        # Adds the size of a content int, the size of the key, and 3 for the 3 NUL byte separators in order to figure
-        # out the header length in bytes
-        return self.content_int_size + key_size + 3
+        # Adds the size of a content int to the size of the bytes leading the header in order to figure out the header
+        # length in bytes
+        return self.content_int_size + len(self.encode_key(key))
 
     def delete(self, key: Union[str, int]):
         """Deletes a entry from the database"""
+        self.value_cache.pop(key, None)
+        if self.version == 1:
+            self.delete_legacy(key)
+            return
+
+        # The entry is only flagged as deleted, its space is reclaimed later on by compacting the database
         content_len = self.read_len(key)
-        entry_location = self.f.tell()
         header_len = self.reconstruct_header_size(key)
-        entry_len = header_len + content_len
+        buffer, offset = self.locate(self.headers[key] + self.content_int_size - header_len)
+        buffer[offset] |= _DELETED_FLAG
+        self.dead_bytes += header_len + content_len
+        del self.headers[key]
 
-        # Seeks to the end of the entry to be deleted
-        self.f.seek(content_len, io.SEEK_CUR)
+        if self.dead_bytes > (self.file_end + len(self.write_buffer)) * _COMPACT_RATIO:
+            try:
+                self.compact()
+            except (OSError, BufferError):
+                # The entry has already been deleted, so compacting is left to be tried again by the next delete or on
+                # close rather than failing the delete
+                pass
 
-        # Steps all preceding data backwards to overwrite the deleted entry
-        while data := self.f.read(1024):
-            read_end = self.f.tell()
-            back_bytes = len(data) + entry_len
-            self.f.seek(back_bytes * -1, io.SEEK_CUR)
-            self.f.write(data)
-            self.f.seek(read_end, io.SEEK_SET)
+    def delete_legacy(self, key: Union[str, int]):
+        """Deletes a entry from a version 1 database, which has no way to flag entries as deleted"""
+        self.flush()
+        content_len = self.read_len(key)
+        entry_location = self.headers[key] + self.content_int_size
+        header_len = self.reconstruct_header_size(key)
+        entry_len = header_len + content_len
+        entry_end = entry_location + content_len
 
-        # Cuts off the now unused end of the file
+        # Shifts all following data backwards to overwrite the deleted entry, then zeroes the now unused end so it's
+        # treated as preallocated space
+        self.mm.move(entry_location - header_len, entry_end, self.file_end - entry_end)
+        self.mm[self.file_end - entry_len:self.file_end] = bytes(entry_len)
+        self.file_end -= entry_len
+        # Seeking relative to the end drops the file object's read buffer, which may no longer match the file
         self.f.seek(0, io.SEEK_END)
-        end = self.f.tell()
-        self.f.truncate(end - entry_len)
 
         # Deletes entry key from cache
         del self.headers[key]
 
         # Corrects locations of entries
-        for key, location in self.headers.items():
-            if location >= entry_location:
-                self.headers[key] = location - entry_len
+        self.headers.shift(entry_location, entry_len)
 
-    def close(self):
-        """Closes the database"""
+    def compact(self):
+        """Rewrites the database file without the space taken up by deleted entries"""
+        self.flush()
+        info_end = self.mm.find(b"\x00") + 1
+        new_headers = {}
+        compact_file = self.path.with_name(self.path.name + ".compact")
+        try:
+            with open(compact_file, "wb") as compact_f:
+                compact_f.write(self.mm[:info_end])
+                pos = info_end
+                # Live entries are copied over in the order they're laid out in
+                for location, key in sorted((location, key) for key, location in self.headers.items()):
+                    entry_start = location + self.content_int_size - self.reconstruct_header_size(key)
+                    entry_end = location + self.content_int_size + self.content_struct.unpack_from(self.mm, location)[0]
+                    compact_f.write(self.mm[entry_start:entry_end])
+                    new_headers[key] = pos + location - entry_start
+                    pos += entry_end - entry_start
+                compact_f.flush()
+                os.fsync(compact_f.fileno())
+            shutil.copymode(self.path, compact_file)
+
+            # Closing the mmap fails while a view from read_view is held, before anything about the database has
+            # changed
+            self.mm.close()
+        except BaseException:
+            compact_file.unlink(missing_ok=True)
+            raise
+
+        # Swaps the compacted file in place of the database file in one step, so the database is never left half
+        # compacted
         self.f.close()
+        os.replace(compact_file, self.path)
+        self.f = open(self.path, "rb+")
+        self.map_file()
+        self.file_end = self.capacity = len(self.mm)
+        self.headers = HeaderIndex.from_dict(new_headers, self.key_int_size)
+        self.dead_bytes = 0
+
+    def close(self):
+        """Closes the database. Does nothing if it's already closed"""
+        if self.f.closed:
+            return
+        self.flush()
+        if self.dead_bytes > self.file_end * _COMPACT_RATIO:
+            self.compact()
+        self.trim()
+        # Also makes sure changes made through the mmap are reflected in the file's mtime before the index is saved
+        self.commit()
+        self.mm.close()
+        try:
+            self.save_index()
+        finally:
+            self.f.close()
+
+    def __del__(self):
+        # Writes left in the write buffer when a database is dropped without being closed are written out, the same as
+        # open files flush their buffers
+        if getattr(self, "write_buffer", None) and not self.f.closed:
+            self.flush()
 
     def __enter__(self):
         return self
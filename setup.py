@@ -9,6 +9,8 @@ with open('README.md') as readme_file:
 
 requirements = [ ]
 
+extras_requirements = {'fast': ['orjson', 'msgpack']}
+
 test_requirements = [ ]
 
 setup(
@@ -27,6 +29,7 @@ setup(
     ],
     description="A simple lazy loaded key:value database",
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     long_description=readme,
     long_description_content_type='text/markdown',
@@ -5,9 +5,18 @@
 
 import unittest
 import os
+import weakref
+from collections import OrderedDict
+from unittest import mock
 from lazy_db import lazy_db
 
 
+def remove_db(file: str = "test_db.lazydb"):
+    """Removes a test db and its saved index"""
+    os.remove(file)
+    os.remove(file + ".idx")
+
+
 class TestLazyDb(unittest.TestCase):
     """Tests for `lazy_db` package."""
 
@@ -18,64 +27,509 @@ class TestLazyDb(unittest.TestCase):
     def tearDown(self):
         """Tear down test fixtures, if any."""
         self.db.close()
-        os.remove("test_db.lazydb")
+        remove_db()
 
     def restart(self):
         self.db.close()
         self.db = lazy_db.LazyDb("test_db.lazydb")
 
-    def test_string_insertions(self):
-        """Test 2 string insertions"""
+    def reopen_without_index(self):
+        self.db.close()
+        os.remove("test_db.lazydb.idx")
+        self.db = lazy_db.LazyDb("test_db.lazydb")
+
+    def test_read_range(self):
+        """test reading a range of int keys"""
+        self.db.write(30, "thirty")
+        self.db.write(10, "ten")
+        self.db.write("test_str", "here is a test value")
+        self.db.write(20, "twenty")
+        self.db.write(40, "forty")
+        self.assertEqual({10: "ten", 20: "twenty", 30: "thirty"}, self.db.read_range(10, 40))
+        self.assertEqual([20, 30], list(self.db.read_range(11, 31)))
+        self.db.delete(20)
+        self.restart()
+        self.assertEqual({10: "ten", 30: "thirty", 40: "forty"}, self.db.read_range(0, 100))
+
+    def test_string_insertions_restart(self):
+        """Test 2 string insertions with restart"""
         self.db.write("test_str", "here is a test value")
         self.db.write("test_str2", "here is a test value2")
+        self.restart()
         value1 = self.db.read("test_str")
         value2 = self.db.read("test_str2")
         self.assertEqual("here is a test value", value1)
         self.assertEqual("here is a test value2", value2)
 
-    def test_int_insertions(self):
-        """test 2 int insertions"""
+    def test_insertion_after_restart(self):
+        """test inserting into a reopened database and reading both entries"""
+        self.db.write("test_str", "here is a test value")
+        self.restart()
+        self.db.write("test_str2", "here is a test value2")
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual("here is a test value2", self.db.read("test_str2"))
+
+    def test_int_insertions_restart(self):
+        """test 2 int insertions with restart"""
         self.db.write("test_str", 346735)
         self.db.write("test_str2", 982745)
+        self.restart()
         value1 = self.db.read("test_str")
         value2 = self.db.read("test_str2")
         self.assertEqual(346735, value1)
         self.assertEqual(982745, value2)
 
-    def test_int_key_insertions(self):
-        """test 2 int key insertions"""
+    def test_int_key_insertions_restart(self):
+        """test 2 int key insertions with restart"""
         self.db.write(43556, 346735)
         self.db.write(234565, "test string")
+        self.restart()
         value1 = self.db.read(43556)
         value2 = self.db.read(234565)
         self.assertEqual(346735, value1)
         self.assertEqual("test string", value2)
 
-    def test_string_insertions_restart(self):
-        """Test 2 string insertions with restart"""
+    def test_dict_insertion_restart(self):
+        """test inserting a dict with restart"""
+        self.db.write("test_str", {"key": "value", "sub": ["list", "of", "things"]})
+        self.restart()
+        value = self.db.read("test_str")
+        self.assertEqual({"key": "value", "sub": ["list", "of", "things"]}, value)
+
+    @unittest.skipIf(lazy_db.msgpack is None, "msgpack is not installed")
+    def test_msgpack_dict_insertion_restart(self):
+        """test dicts are stored as msgpack when it's installed, keeping int keys intact"""
+        self.db.write("test_str", {"key": "value", 1: [1, 2], "bin": b"bytes"})
+        self.restart()
+        self.assertEqual(6, self.db.mm[self.db.headers["test_str"] + self.db.content_int_size])
+        self.assertEqual({"key": "value", 1: [1, 2], "bin": b"bytes"}, self.db.read("test_str"))
+
+    def test_json_dict_format_restart(self):
+        """test databases set up to store dicts as json keep doing so, whether or not msgpack is installed"""
+        self.db.close()
+        remove_db()
+        self.db = lazy_db.LazyDb("test_db.lazydb", dict_format="json")
+        self.db.write("test_str", {"1": [1, 2]})
+        self.restart()
+        self.assertEqual("json", self.db.get_info()["dict_format"])
+        self.db.write("test_str2", {"key": "value"})
+        self.assertEqual(3, self.db.mm[self.db.headers["test_str"] + self.db.content_int_size])
+        self.assertEqual({"1": [1, 2]}, self.db.read("test_str"))
+        self.assertEqual({"key": "value"}, self.db.read("test_str2"))
+
+    def test_msgpack_dict_format_without_msgpack(self):
+        """test writing dicts to a database set up to store them as msgpack fails without msgpack installed"""
+        self.db.close()
+        remove_db()
+        self.db = lazy_db.LazyDb("test_db.lazydb", dict_format="msgpack")
+        with mock.patch.object(lazy_db, "msgpack", None):
+            self.assertRaises(ImportError, self.db.write, "test_str", {"key": "value"})
+        self.assertNotIn("test_str", self.db.headers)
+        self.assertRaises(ValueError, lazy_db.LazyDb, "test_db2.lazydb", dict_format="pickle")
+        self.assertFalse(os.path.exists("test_db2.lazydb"))
+
+    def test_delete_read_restart(self):
+        """test deleting an element, and then reading another after a restart"""
+        self.db.write("test_str", "here is a test value")
+        self.db.write("test_str2", "here is a test value2")
+        self.db.delete("test_str")
+        self.restart()
+        self.assertEqual("here is a test value2", self.db.read("test_str2"))
+
+    def test_delete_middle_restart(self):
+        """test deleting an element between two others, and then reading the others after a restart"""
+        self.db.write("test_str", "here is a test value")
+        self.db.write(43556, [435, 4636, 123])
+        self.db.write("test_str2", "here is a test value2")
+        self.db.delete(43556)
+        self.restart()
+        self.assertEqual(os.path.getsize("test_db.lazydb"), self.db.file_end)
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual("here is a test value2", self.db.read("test_str2"))
+        self.assertNotIn(43556, self.db.headers)
+
+    def test_delete_tombstone(self):
+        """test deleted entries are skipped when indexing until the database is compacted"""
+        self.db.write("test_str", b"a" * 1000)
+        self.db.write("test_str2", "here is a test value2")
+        self.db.delete("test_str2")
+        self.db.flush()
+        file_end = self.db.file_end
+        self.reopen_without_index()
+        self.assertEqual(file_end, self.db.file_end)
+        self.assertLess(0, self.db.dead_bytes)
+        self.assertNotIn("test_str2", self.db.headers)
+        self.db.compact()
+        self.assertEqual(0, self.db.dead_bytes)
+        self.assertGreater(file_end, self.db.file_end)
+        self.assertEqual(b"a" * 1000, self.db.read("test_str"))
+        self.reopen_without_index()
+        self.assertEqual(b"a" * 1000, self.db.read("test_str"))
+        self.assertEqual(1, len(self.db.headers))
+
+    @unittest.skipIf(os.name == "nt", "File modes aren't fully supported on Windows")
+    def test_compact_keeps_mode(self):
+        """test compacting keeps the permissions of the database file"""
+        os.chmod("test_db.lazydb", 0o600)
+        self.db.write("test_str", "here is a test value")
+        self.db.compact()
+        self.assertEqual(0o600, os.stat("test_db.lazydb").st_mode & 0o777)
+
+    def test_compact_with_view_held(self):
+        """test compacting while a view is held fails without leaving anything behind"""
+        self.db.write("test_str", b"a" * 1000)
+        self.db.write("test_str2", "here is a test value")
+        self.db.delete("test_str2")
+        with self.db.read_view("test_str") as view:
+            self.assertRaises(BufferError, self.db.compact)
+            self.assertEqual(b"a" * 1000, view)
+        self.assertFalse(os.path.exists("test_db.lazydb.compact"))
+        self.db.compact()
+        self.assertEqual(b"a" * 1000, self.db.read("test_str"))
+
+    def test_delete_with_view_held(self):
+        """test deleting past the compaction threshold while a view is held still deletes, and compacts later"""
+        self.db.write("test_str", b"a" * 100)
+        self.db.write("test_str2", "here is a test value" * 10)
+        with self.db.read_view("test_str") as view:
+            self.db.delete("test_str2")
+            self.assertEqual(b"a" * 100, view)
+        self.assertNotIn("test_str2", self.db.headers)
+        self.assertLess(0, self.db.dead_bytes)
+        self.assertFalse(os.path.exists("test_db.lazydb.compact"))
+        self.restart()
+        self.assertEqual(0, self.db.dead_bytes)
+        self.assertNotIn("test_str2", self.db.headers)
+        self.assertEqual(b"a" * 100, self.db.read("test_str"))
+
+    def test_delete_rewrite_restart(self):
+        """test writing a key again after deleting it"""
+        self.db.write("test_str", b"a" * 1000)
+        self.db.write("test_str2", "here is a test value")
+        self.db.delete("test_str2")
+        self.db.write("test_str2", "here is a test value2")
+        self.reopen_without_index()
+        self.assertEqual("here is a test value2", self.db.read("test_str2"))
+
+    def test_write_bytes_restart(self):
+        """test writing bytes to database with restart"""
+        self.db.write("test_str", b"Hi there (but in bytes)")
+        self.db.write("test_str2", b"Hi there (but in bytes)2")
+        self.restart()
+        self.assertEqual(b"Hi there (but in bytes)", self.db.read("test_str"))
+        self.assertEqual(b"Hi there (but in bytes)2", self.db.read("test_str2"))
+
+    def test_write_int_list_restart(self):
+        """Tests writing int list to db with restart"""
+        self.db.write("test_str", [435, 4636, 123, 768, 2356, 436])
+        self.db.write("test_str2", [436, 2356, 35, 235, 6546, 4537])
+        self.restart()
+        self.assertEqual([435, 4636, 123, 768, 2356, 436], self.db.read("test_str"))
+        self.assertEqual([436, 2356, 35, 235, 6546, 4537], self.db.read("test_str2"))
+
+    def test_flush(self):
+        """Tests buffered entries can be read before and after being flushed to the file"""
+        self.db.write("test_str", "here is a test value")
+        self.db.flush()
+        self.db.write("test_str2", "here is a test value2")
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual("here is a test value2", self.db.read("test_str2"))
+        self.db.flush()
+        self.assertEqual(0, len(self.db.write_buffer))
+        self.assertEqual(os.path.getsize("test_db.lazydb"), self.db.capacity)
+        self.assertLessEqual(self.db.file_end, self.db.capacity)
+        self.assertEqual("here is a test value2", self.db.read("test_str2"))
+
+    def test_value_cache(self):
+        """Tests small immutable values are cached once read, and evicted once deleted"""
+        large_value = bytes(range(256)) * 32
+        self.db.write("test_str", "here is a test value")
+        self.db.write("test_str2", {"a": 1})
+        self.db.write("test_str3", large_value)
+        self.assertEqual(0, len(self.db.value_cache))
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual({"a": 1}, self.db.read("test_str2"))
+        self.assertEqual(large_value, self.db.read("test_str3"))
+        self.assertEqual(["test_str"], list(self.db.value_cache))
+        with mock.patch.object(self.db, "decode") as decode:
+            self.assertEqual("here is a test value", self.db.read("test_str"))
+            decode.assert_not_called()
+        self.db.delete("test_str")
+        self.assertNotIn("test_str", self.db.value_cache)
+        self.assertRaises(KeyError, self.db.read, "test_str")
+        self.db.write(43556, True)
+        self.assertEqual(1, self.db.read(43556))
+        self.assertIs(int, type(self.db.value_cache[43556]))
+
+    def test_value_cache_size(self):
+        """Tests the least recently used value is evicted once the cache is full, and that caching can be disabled"""
+        self.db.close()
+        self.db = lazy_db.LazyDb("test_db.lazydb", cache_size=2)
+        self.db.write("test_str", "here is a test value")
+        self.db.write("test_str2", "here is a test value2")
+        self.db.write("test_str3", "here is a test value3")
+        self.db.read("test_str")
+        self.db.read("test_str2")
+        self.db.read("test_str")
+        self.db.read("test_str3")
+        self.assertEqual(["test_str", "test_str3"], list(self.db.value_cache))
+        self.db.close()
+        self.db = lazy_db.LazyDb("test_db.lazydb", cache_size=0)
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual(0, len(self.db.value_cache))
+
+    def test_without_mmap_resize(self):
+        """Tests writing, growing and trimming the file on platforms where mmap can't be resized"""
+        class UnresizableMmap(lazy_db.mmap.mmap):
+            def resize(self, newsize):
+                raise SystemError("mmap: resizing not available--no mremap()")
+
+        large_value = bytes(range(256)) * 8192
+        with mock.patch.object(lazy_db.mmap, "mmap", UnresizableMmap):
+            self.db.close()
+            self.db = lazy_db.LazyDb("test_db.lazydb")
+            self.db.write("test_str", "here is a test value")
+            self.db.write("test_str2", large_value)
+            self.db.flush()
+            self.assertEqual(os.path.getsize("test_db.lazydb"), self.db.capacity)
+            self.restart()
+        self.assertEqual(os.path.getsize("test_db.lazydb"), self.db.file_end)
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual(large_value, self.db.read("test_str2"))
+
+    def test_dropped_without_close(self):
+        """Tests buffered writes reach the file when a database is dropped without being closed"""
+        self.db.write("test_str", "here is a test value")
+        db_ref = weakref.ref(self.db)
+        del self.db
+        self.assertIsNone(db_ref())
+        self.db = lazy_db.LazyDb("test_db.lazydb")
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+
+    def test_failed_flush(self):
+        """Tests an entry whose write fails while flushing the write buffer is never written to the file"""
+        large_value = bytes(range(256)) * 8192
+        self.db.write("test_str", "here is a test value")
+        with mock.patch.object(self.db, "write_at", side_effect=OSError("No space left on device")):
+            self.assertRaises(OSError, self.db.write, "test_str2", large_value)
+        self.assertNotIn("test_str2", self.db.headers)
+        self.reopen_without_index()
+        self.assertNotIn("test_str2", self.db.headers)
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+
+    @unittest.skipUnless(hasattr(os, "pwrite"), "os.pwrite is not available")
+    def test_short_writes(self):
+        """Tests flushing keeps writing when the OS writes less than asked for at a time"""
+        pwrite = os.pwrite
+        self.db.write("test_str", "here is a test value")
+        self.db.write(43556, b"\x00\x01\x02")
+        with mock.patch.object(lazy_db.os, "pwrite", lambda fd, data, offset: pwrite(fd, data[:3], offset)):
+            self.db.flush()
+        self.restart()
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual(b"\x00\x01\x02", self.db.read(43556))
+
+    def test_large_write(self):
+        """Tests writing values bigger than the write buffer"""
+        large_value = bytes(range(256)) * 8192
+        self.db.write("test_str", "here is a test value")
+        self.db.write("test_str2", large_value)
+        self.db.write("test_str3", "here is a test value3")
+        self.assertEqual(large_value, self.db.read("test_str2"))
+        self.restart()
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual(large_value, self.db.read("test_str2"))
+        self.assertEqual("here is a test value3", self.db.read("test_str3"))
+
+    def test_saved_index(self):
+        """Tests the headers saved on close are loaded when reopening"""
+        self.db.write("test_str", "here is a test value")
+        self.db.write(43556, 346735)
+        with mock.patch.object(lazy_db.LazyDb, "get_headers") as get_headers:
+            self.restart()
+        get_headers.assert_not_called()
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual(346735, self.db.read(43556))
+
+    def test_unsaveable_index(self):
+        """Tests closing still succeeds when the index can't be saved, and that closing twice does nothing"""
         self.db.write("test_str", "here is a test value")
+        with mock.patch.object(lazy_db.Path, "write_bytes", side_effect=PermissionError("Permission denied")):
+            self.db.close()
+        self.assertTrue(self.db.f.closed)
+        self.assertFalse(os.path.exists("test_db.lazydb.idx"))
+        self.db.close()
+        self.db = lazy_db.LazyDb("test_db.lazydb")
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+
+    def test_stale_index(self):
+        """Tests a saved index is ignored when the database has changed without it being saved again"""
+        self.db.write("test_str", "here is a test value")
+        self.restart()
+        self.db.write("test_str2", "here is a test value2")
+        self.db.flush()
+        # Closes the files without saving the index, as if the process was killed
+        self.db.mm.close()
+        self.db.f.close()
+        self.db = lazy_db.LazyDb("test_db.lazydb")
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual("here is a test value2", self.db.read("test_str2"))
+
+    def test_write_many(self):
+        """Tests writing many values at once commits them to the file"""
+        self.db.write_many([("test_str", "here is a test value"), (43556, 346735), ("test_str2", [435, 4636])])
+        self.assertEqual(0, len(self.db.write_buffer))
+        self.assertEqual(346735, self.db.read(43556))
+        self.restart()
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual([435, 4636], self.db.read("test_str2"))
+
+    def test_preallocated_space_after_kill(self):
+        """Tests space preallocated past the last entry is ignored when the database wasn't closed cleanly"""
+        self.db.write("test_str", "here is a test value")
+        self.db.write(43556, 346735)
+        self.db.flush()
+        file_end = self.db.file_end
+        self.assertLess(file_end, os.path.getsize("test_db.lazydb"))
+        # Closes the files without trimming the file or saving the index, as if the process was killed
+        self.db.mm.close()
+        self.db.f.close()
+        self.db = lazy_db.LazyDb("test_db.lazydb")
+        self.assertEqual(file_end, self.db.file_end)
         self.db.write("test_str2", "here is a test value2")
         self.restart()
+        self.assertEqual(os.path.getsize("test_db.lazydb"), self.db.file_end)
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+        self.assertEqual(346735, self.db.read(43556))
+        self.assertEqual("here is a test value2", self.db.read("test_str2"))
+
+    def test_short_preallocated_space(self):
+        """Tests preallocated space too short to hold an entry header is ignored"""
+        self.db.write("test_str", "here is a test value")
+        self.db.close()
+        with open("test_db.lazydb", "ab") as f:
+            f.write(b"\x00\x00")
+        os.remove("test_db.lazydb.idx")
+        self.db = lazy_db.LazyDb("test_db.lazydb")
+        self.assertEqual(os.path.getsize("test_db.lazydb") - 2, self.db.file_end)
+        self.assertEqual("here is a test value", self.db.read("test_str"))
+
+    def test_write_mixed_list_restart(self):
+        """Tests writing lists that can't be stored as int lists with restart"""
+        self.db.write("test_str", ["list", 1, {"key": "value"}])
+        self.db.write("test_str2", [-1, 2 ** 40])
+        self.restart()
+        self.assertEqual(["list", 1, {"key": "value"}], self.db.read("test_str"))
+        self.assertEqual([-1, 2 ** 40], self.db.read("test_str2"))
+
+    def test_delete_last_value(self):
+        """Deletes the last value in a database and restarts"""
+        self.db.write("test_str", "test")
+        self.db.delete("test_str")
+        self.restart()
+        self.assertEqual(0, len(self.db.headers))
+
+
+class TestLazyDbShared(unittest.TestCase):
+    """Tests for `lazy_db` package that don't restart the database, which share one database emptied after each test."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test db shared by all tests"""
+        cls.db = lazy_db.LazyDb("test_shared_db.lazydb")
+
+    @classmethod
+    def tearDownClass(cls):
+        """Tear down test db shared by all tests"""
+        cls.db.close()
+        remove_db("test_shared_db.lazydb")
+
+    def tearDown(self):
+        """Deletes all entries written by the test"""
+        for key in list(self.db.headers):
+            self.db.delete(key)
+
+    def test_string_insertions(self):
+        """Test 2 string insertions"""
+        self.db.write("test_str", "here is a test value")
+        self.db.write("test_str2", "here is a test value2")
         value1 = self.db.read("test_str")
         value2 = self.db.read("test_str2")
         self.assertEqual("here is a test value", value1)
         self.assertEqual("here is a test value2", value2)
 
-    def test_int_insertions_restart(self):
-        """test 2 int insertions with restart"""
+    def test_int_insertions(self):
+        """test 2 int insertions"""
         self.db.write("test_str", 346735)
         self.db.write("test_str2", 982745)
-        self.restart()
         value1 = self.db.read("test_str")
         value2 = self.db.read("test_str2")
         self.assertEqual(346735, value1)
         self.assertEqual(982745, value2)
 
-    def test_int_key_insertions_restart(self):
-        """test 2 int key insertions with restart"""
+    def test_gc_state_kept(self):
+        """Test that writing and reading re-enables the garbage collector only if it was enabled before"""
+        self.db.write("test_str", {"a": [1, 2]})
+        self.db.read("test_str")
+        self.assertTrue(lazy_db.gc.isenabled())
+        lazy_db.gc.disable()
+        try:
+            self.db.write("test_str2", {"b": [3, 4]})
+            self.assertEqual({"b": [3, 4]}, self.db.read("test_str2"))
+            self.assertFalse(lazy_db.gc.isenabled())
+        finally:
+            lazy_db.gc.enable()
+
+    def test_read_view(self):
+        """Test reading bytes as a view, both before and after they've been flushed"""
+        self.db.write("test_str", b"\x00\x01\x02")
+        self.db.write("test_str2", "here is a test value")
+        with self.db.read_view("test_str") as view:
+            self.assertEqual(b"\x00\x01\x02", view)
+            capacity = self.db.capacity
+            self.assertRaises(BufferError, self.db.reserve, capacity * 2)
+            self.assertEqual(capacity, self.db.capacity)
+        with self.db.read_view("test_str") as view:
+            self.assertEqual(b"\x00\x01\x02", view.tobytes())
+        self.assertRaises(TypeError, self.db.read_view, "test_str2")
+        self.assertRaises(KeyError, self.db.read_view, "test_str3")
+
+    def test_int_edge_insertions(self):
+        """test inserting 0 and exact powers of 256"""
+        self.db.write("test_str", 0)
+        self.db.write("test_str2", 256)
+        self.db.write("test_str3", 2 ** 64)
+        self.assertEqual(0, self.db.read("test_str"))
+        self.assertEqual(256, self.db.read("test_str2"))
+        self.assertEqual(2 ** 64, self.db.read("test_str3"))
+
+    def test_negative_int_insertions(self):
+        """test inserting negative ints, which are stored in as few bytes as they fit in"""
+        self.db.write("test_str", -1)
+        self.db.write("test_str2", -129)
+        self.db.write("test_str3", -2 ** 64)
+        self.db.write("test_str4", -128)
+        self.assertEqual(-1, self.db.read("test_str"))
+        self.assertEqual(-129, self.db.read("test_str2"))
+        self.assertEqual(-2 ** 64, self.db.read("test_str3"))
+        self.assertEqual(-128, self.db.read("test_str4"))
+        self.assertEqual(2, self.db.read_len("test_str"))
+        self.assertEqual(3, self.db.read_len("test_str2"))
+        self.assertEqual(2, self.db.read_len("test_str4"))
+
+    def test_subclass_insertions(self):
+        """test inserting subclasses of supported types"""
+        self.db.write("test_str", OrderedDict(key="value"))
+        self.db.write("test_str2", True)
+        self.assertEqual({"key": "value"}, self.db.read("test_str"))
+        self.assertEqual(1, self.db.read("test_str2"))
+        with self.assertRaises(TypeError):
+            self.db.write("test_str3", 1.5)
+
+    def test_int_key_insertions(self):
+        """test 2 int key insertions"""
         self.db.write(43556, 346735)
         self.db.write(234565, "test string")
-        self.restart()
         value1 = self.db.read(43556)
         value2 = self.db.read(234565)
         self.assertEqual(346735, value1)
@@ -87,13 +541,6 @@ class TestLazyDb(unittest.TestCase):
         value = self.db.read("test_str")
         self.assertEqual({"key": "value", "sub": ["list", "of", "things"]}, value)
 
-    def test_dict_insertion_restart(self):
-        """test inserting a dict with restart"""
-        self.db.write("test_str", {"key": "value", "sub": ["list", "of", "things"]})
-        self.restart()
-        value = self.db.read("test_str")
-        self.assertEqual({"key": "value", "sub": ["list", "of", "things"]}, value)
-
     def test_deletion(self):
         """test deleting an element"""
         self.db.write("test_str", "here is a test value")
@@ -109,14 +556,6 @@ class TestLazyDb(unittest.TestCase):
         self.db.delete("test_str")
         self.assertEqual("here is a test value2", self.db.read("test_str2"))
 
-    def test_delete_read_restart(self):
-        """test deleting an element, and then reading another after a restart"""
-        self.db.write("test_str", "here is a test value")
-        self.db.write("test_str2", "here is a test value2")
-        self.db.delete("test_str")
-        self.restart()
-        self.assertEqual("here is a test value2", self.db.read("test_str2"))
-
     def test_write_bytes(self):
         """test writing bytes to database"""
         self.db.write("test_str", b"Hi there (but in bytes)")
@@ -124,14 +563,6 @@ class TestLazyDb(unittest.TestCase):
         self.assertEqual(b"Hi there (but in bytes)", self.db.read("test_str"))
         self.assertEqual(b"Hi there (but in bytes)2", self.db.read("test_str2"))
 
-    def test_write_bytes_restart(self):
-        """test writing bytes to database with restart"""
-        self.db.write("test_str", b"Hi there (but in bytes)")
-        self.db.write("test_str2", b"Hi there (but in bytes)2")
-        self.restart()
-        self.assertEqual(b"Hi there (but in bytes)", self.db.read("test_str"))
-        self.assertEqual(b"Hi there (but in bytes)2", self.db.read("test_str2"))
-
     def test_write_int_list(self):
         """Tests writing int list to db"""
         self.db.write("test_str", [435, 4636, 123, 768, 2356, 436])
@@ -139,21 +570,6 @@ class TestLazyDb(unittest.TestCase):
         self.assertEqual([435, 4636, 123, 768, 2356, 436], self.db.read("test_str"))
         self.assertEqual([436, 2356, 35, 235, 6546, 4537], self.db.read("test_str2"))
 
-    def test_write_int_list_restart(self):
-        """Tests writing int list to db with restart"""
-        self.db.write("test_str", [435, 4636, 123, 768, 2356, 436])
-        self.db.write("test_str2", [436, 2356, 35, 235, 6546, 4537])
-        self.restart()
-        self.assertEqual([435, 4636, 123, 768, 2356, 436], self.db.read("test_str"))
-        self.assertEqual([436, 2356, 35, 235, 6546, 4537], self.db.read("test_str2"))
-
-    def test_delete_last_value(self):
-        """Deletes the last value in a database and restarts"""
-        self.db.write("test_str", "test")
-        self.db.delete("test_str")
-        self.restart()
-        self.assertEqual(0, len(self.db.headers))
-
 
 class TestLazyDbSetupless(unittest.TestCase):
     """Tests for `lazy_db` package that don't use to use setup or teardown methods."""
@@ -165,7 +581,7 @@ class TestLazyDbSetupless(unittest.TestCase):
             self.assertEqual("test val", db.read("test_str"))
             self.assertFalse(db.f.closed, "file prematurely closed")
         self.assertTrue(db.f.closed, "file not closed after exiting context")
-        os.remove("test_db.lazydb")
+        remove_db()
 
     def test_context_exception(self):
         """Tests if the database can be opened and closed via the with statement cleanly with an exception"""
@@ -178,4 +594,127 @@ class TestLazyDbSetupless(unittest.TestCase):
             pass
 
         self.assertTrue(db.f.closed)
-        os.remove("test_db.lazydb")
+        remove_db()
+
+    def test_legacy_format(self):
+        """Tests version 1 databases, where keys are terminated by a NUL byte, can still be read and written to"""
+        with open("test_db.lazydb", "wb") as f:
+            f.write(b'{"key_int_size":4,"content_int_size":4,"int_list_size":4}\x00'
+                    b'\x00\x01test_str\x00\x15\x00\x00\x00\x01here is a test value'
+                    b'\x00\x02\x24\xaa\x00\x00\x00\x04\x00\x00\x00\x02\x6f\x4a\x05')
+        with lazy_db.LazyDb("test_db.lazydb") as db:
+            self.assertEqual(1, db.version)
+            self.assertEqual("here is a test value", db.read("test_str"))
+            self.assertEqual(346735, db.read(43556))
+            db.write("test_str2", "here is a test value2")
+            db.delete("test_str")
+        os.remove("test_db.lazydb.idx")
+        with lazy_db.LazyDb("test_db.lazydb") as db:
+            self.assertEqual(346735, db.read(43556))
+            self.assertEqual("here is a test value2", db.read("test_str2"))
+            self.assertNotIn("test_str", db.headers)
+        remove_db()
+
+    def test_legacy_short_preallocated_space(self):
+        """Tests a single byte of preallocated space left past the last entry of a version 1 database is ignored"""
+        with open("test_db.lazydb", "wb") as f:
+            f.write(b'{"key_int_size":4,"content_int_size":4,"int_list_size":4}\x00'
+                    b'\x00\x01test_str\x00\x15\x00\x00\x00\x01here is a test value\x00')
+        with lazy_db.LazyDb("test_db.lazydb") as db:
+            self.assertEqual(os.path.getsize("test_db.lazydb") - 1, db.file_end)
+            self.assertEqual("here is a test value", db.read("test_str"))
+        remove_db()
+
+    def test_out_of_range_ints(self):
+        """Tests int keys, content lengths and int lists too big for their size raise OverflowError with any size"""
+        for key_int_size in (4, 3):
+            with lazy_db.LazyDb("test_db.lazydb", key_int_size=key_int_size, content_int_size=1) as db:
+                self.assertRaises(OverflowError, db.write, -1, "test string")
+                self.assertRaises(OverflowError, db.write, 2 ** 40, "test string")
+                self.assertRaises(OverflowError, db.write, "test_str", "a" * 300)
+                self.assertRaises(OverflowError, db.int_list_to_bytes, [2 ** 40])
+                self.assertEqual(0, len(db.headers))
+            remove_db()
+
+    def test_uncommon_int_sizes(self):
+        """Tests integer sizes struct doesn't natively support round trip after a restart"""
+        with lazy_db.LazyDb("test_db.lazydb", key_int_size=3, content_int_size=5, int_list_size=3) as db:
+            db.write(43556, "test string")
+            db.write("test_str", 346735)
+            db.write("test_str2", [435, 4636, 123, 768, 2356, 436])
+        with lazy_db.LazyDb("test_db.lazydb") as db:
+            self.assertEqual("test string", db.read(43556))
+            self.assertEqual(346735, db.read("test_str"))
+            self.assertEqual([435, 4636, 123, 768, 2356, 436], db.read("test_str2"))
+        remove_db()
+
+
+class TestHeaderIndex(unittest.TestCase):
+    """Tests for the header index used by `lazy_db`."""
+
+    def test_mapping(self):
+        """Tests setting, getting and deleting string and int keys"""
+        index = lazy_db.HeaderIndex()
+        index["test_str"] = 10
+        index[30] = 20
+        index[10] = 30
+        self.assertEqual(10, index["test_str"])
+        self.assertEqual(20, index[30])
+        self.assertEqual(30, index[10])
+        self.assertEqual(3, len(index))
+        self.assertNotIn(20, index)
+        del index[30]
+        with self.assertRaises(KeyError):
+            index[30]
+        self.assertEqual({"test_str": 10, 10: 30}, dict(index))
+
+    def test_from_dict(self):
+        """Tests building an index keeps int keys sorted"""
+        index = lazy_db.HeaderIndex.from_dict({30: 1, "test_str": 2, 10: 3, 20: 4})
+        self.assertEqual([10, 20, 30], list(index.int_keys))
+        self.assertEqual([3, 4, 1], list(index.int_locations))
+        self.assertEqual([20, 30], list(index.int_range(11, 31)))
+
+    def test_many_descending_int_keys(self):
+        """Tests many int keys set and deleted out of order are merged into the arrays in order"""
+        index = lazy_db.HeaderIndex()
+        for key in range(100000, 0, -1):
+            index[key] = key * 2
+        self.assertEqual(100000, len(index))
+        self.assertEqual(20, index[10])
+        for key in range(100000, 0, -2):
+            del index[key]
+        self.assertEqual(50000, len(index))
+        self.assertNotIn(100000, index)
+        self.assertEqual(list(range(1, 100000, 2)), list(index.int_range(0, 100001)))
+        self.assertEqual([key * 2 for key in range(1, 100000, 2)], list(index.int_locations))
+
+    def test_shift(self):
+        """Tests shifting locations back from a point"""
+        index = lazy_db.HeaderIndex.from_dict({"a": 5, "b": 50, 1: 10, 2: 60})
+        index.shift(50, 20)
+        self.assertEqual({"a": 5, "b": 30, 1: 10, 2: 40}, dict(index))
+
+    def test_wide_int_keys(self):
+        """Tests int keys too big for an array"""
+        index = lazy_db.HeaderIndex(key_int_size=16)
+        index[2 ** 100] = 1
+        index[5] = 2
+        self.assertEqual(1, index[2 ** 100])
+        self.assertEqual([5, 2 ** 100], list(index.int_range(0, 2 ** 101)))
+
+    def test_dump_load(self):
+        """Tests an index can be dumped to bytes and loaded back"""
+        index = lazy_db.HeaderIndex.from_dict({30: 1, "test_str": 2, 10: 3, "tëst_str2": 4, "": 5})
+        loaded = lazy_db.HeaderIndex.load(index.dump())
+        self.assertEqual(dict(index), dict(loaded))
+        self.assertEqual([10, 30], list(loaded.int_keys))
+
+        wide_index = lazy_db.HeaderIndex.from_dict({2 ** 100: 1, 5: 2, "test_str": 3}, key_int_size=16)
+        self.assertEqual(dict(wide_index), dict(lazy_db.HeaderIndex.load(wide_index.dump(), key_int_size=16)))
+
+    def test_load_malformed(self):
+        """Tests loading truncated bytes raises ValueError"""
+        data = lazy_db.HeaderIndex.from_dict({30: 1, "test_str": 2}).dump()
+        with self.assertRaises(ValueError):
+            lazy_db.HeaderIndex.load(data[:-1])